@@ -11,18 +11,123 @@ Features:
 - Beautiful Streamlit UI with embedded avatar
 """
 
+from __future__ import annotations
+
 import streamlit as st
 import os
-import requests
 import asyncio
-import tempfile
-import json
+import hashlib
+import time
+import orjson
+import itertools
+import re
+import textwrap
+import uuid
+from collections import deque
+from typing import TYPE_CHECKING
 from dotenv import load_dotenv
-from memu.app import MemoryService
+from memory_utils import (
+    add_session_closer,
+    get_session_loop,
+    limit_context_parts,
+    memorize_in_batches,
+    resume_marker,
+    run_memu,
+    shared_memu_service,
+    submit_memu,
+    unsaved_messages,
+)
+
+# httpx and memu are imported where they are used, so the page can render before
+# they load. Streamlit reruns reuse sys.modules, so each one loads once per process
+if TYPE_CHECKING:
+    import httpx
+    from memu.app import MemoryService
 
 # Load environment variables
 load_dotenv()
 
+# API keys, read once per run instead of at every use
+ANAM_API_KEY = os.getenv("ANAM_API_KEY")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+HAS_ANAM = bool(ANAM_API_KEY)
+HAS_OPENAI = bool(OPENAI_API_KEY)
+
+# Timeouts (seconds) for calls to the Anam API
+ANAM_REQUEST_TIMEOUT = 10.0
+ANAM_CONNECT_TIMEOUT = 3.05
+
+# How long a retrieved memory context stays valid before MemU is queried again
+MEMORY_CONTEXT_TTL_SECONDS = 300
+
+# Character budget for memory context injected into the avatar's system prompt
+MEMORY_CONTEXT_CHAR_BUDGET = 2000
+
+# Upper bound on conversation turns kept in the session
+MAX_HISTORY_MESSAGES = 500
+
+# Largest slice of a conversation sent to a single memorize call
+SAVE_BATCH_MESSAGES = 20
+
+# Seconds between Memory Status refreshes while a background save is running
+SAVE_STATUS_POLL_SECONDS = 2
+
+# Sidebar choices, built once instead of on every rerun
+AVATAR_OPTIONS = {
+    "Cara (Default)": "30fa96d0-26c4-4e55-94a0-517025942e18",
+    "Richard": "richard-avatar-id",
+    "Ben": "ben-avatar-id",
+    "Liv": "liv-avatar-id",
+    "Custom": "custom"
+}
+AVATAR_LIST = list(AVATAR_OPTIONS)
+
+VOICE_OPTIONS = {
+    "Default Voice": "6bfbe25a-979d-40f3-a92b-5394170af54b",
+    "Custom": "custom"
+}
+VOICE_LIST = list(VOICE_OPTIONS)
+
+def _compact_prompt(prompt: str) -> str:
+    """Strip indentation, trailing spaces and extra blank lines that only cost tokens."""
+    prompt = textwrap.dedent(prompt).strip()
+    prompt = re.sub(r"[ \t]+$", "", prompt, flags=re.MULTILINE)
+    return re.sub(r"\n{3,}", "\n\n", prompt)
+
+
+DEFAULT_SYSTEM_PROMPT = _compact_prompt("""You are Maya, a friendly and helpful AI doctor’s assistant. Your role is to check the user's current medications, ask proactively about the last medications they've taken (using memory or prior user history if available), and provide assistance or reminders as needed.
+
+- Always respond in a warm, conversational manner appropriate for a healthcare assistant.
+- Use empathetic language and active listening techniques to build rapport with the user.
+- Be concise and clear in your communication.
+- When interacting with a user, first recall and mention any medications mentioned or logged previously (if such data exists).
+- Proactively ask the user about their last medications: inquire about times taken, missed doses, changes, or any side effects.
+- Offer to help log new medications, remind about dosage or schedules, and answer related questions.
+- Do not give direct clinical advice or prescription suggestions—instead, guide the user to consult a healthcare professional for such needs.
+- If no memory or medication history is present, gently prompt the user to share their current medications.
+- If the user mentions changes in medication or new symptoms, ask for clarifying details and offer supportive suggestions (e.g., tracking, discussing with their doctor, etc.).
+
+**Output Format:**  
+Always respond in concise, friendly conversational English, suitable for a chat interface. Limit replies to 2-4 short paragraphs.
+
+**Examples:**
+
+**Example 1:**  
+_User’s medication memory_: “Last logged: Lisinopril 10mg at 8am.”  
+Maya: “Welcome back Sudhanshu! I see you last took Lisinopril 10mg at 8am. Have you taken your next dose yet, or are there any changes to your medication plan? If you’ve experienced any side effects, let me know so I can help keep track for you!”
+
+**Example 2:**  
+_(No medication memory found)_  
+Maya: “Hi Sudhanshu! I don’t have any medications logged for you yet. Can you tell me what medications you’re currently taking? I can help you track your schedule and remind you if you’d like.”
+
+**Example 3:**  
+_User: “I missed my last dose of metformin.”_  
+Maya: “Thank you for letting me know you missed your last dose of metformin. Would you like me to remind you about your next dose, or help you log your medication times more regularly? Always let your doctor know about any missed doses, especially if you feel unwell.”
+
+**Important Reminder:**  
+You are a proactive and friendly AI doctor assistant. Always check or recall the user’s medication history if available, ask about current or recent medication use, and offer appropriate, non-clinical assistance. Never give medical advice—prompt users to contact their healthcare provider for medical concerns.""")
+
+
 # Page configuration
 st.set_page_config(
     page_title="Anam AI Avatar with MemU Memory",
@@ -31,8 +136,27 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+
+def _init_state():
+    """Seed st.session_state with defaults for any keys not set yet."""
+    defaults = {
+        "conversation_history": deque(maxlen=MAX_HISTORY_MESSAGES),
+        "avatar_active": False,
+        "total_conversations": 0,
+        "memory_items": 0,
+        "memu_service": None,
+        "memory_initialized": False,
+        "pending_saves": [],
+        "last_saved_message": None,
+        # The MemU service is shared by every session, so memories are scoped per session
+        "memu_user_id": uuid.uuid4().hex,
+    }
+    for key, value in defaults.items():
+        st.session_state.setdefault(key, value)
+
+
 # Custom CSS for styling
-st.markdown("""
+_CSS = """
 <style>
     .main-header {
         font-size: 2.5rem;
@@ -78,153 +202,230 @@ st.markdown("""
         text-align: left;
     }
 </style>
-""", unsafe_allow_html=True)
-
-# Session state initialization
-if "conversation_history" not in st.session_state:
-    st.session_state.conversation_history = []
-if "avatar_active" not in st.session_state:
-    st.session_state.avatar_active = False
-if "total_conversations" not in st.session_state:
-    st.session_state.total_conversations = 0
-if "memory_items" not in st.session_state:
-    st.session_state.memory_items = 0
-if "memu_service" not in st.session_state:
-    st.session_state.memu_service = None
-if "memory_initialized" not in st.session_state:
-    st.session_state.memory_initialized = False
+"""
+
+
+# Page title and tagline
+_HEADER_HTML = """
+<h1 class="main-header">🎭 AI Avatar with MemU Memory and Anam</h1>
+<p style="text-align: center; color: #666; font-size: 1.1rem;">
+    Interactive AI Avatar powered by Anam AI with persistent memory via MemU
+</p>
+"""
+
+# Footer with links to the underlying services
+_FOOTER_HTML = """
+    <div style="text-align: center; color: #999; font-size: 0.9rem;">
+        Powered by <a href="https://anam.ai" target="_blank">Anam AI</a> for avatars 
+        and <a href="https://github.com/memu-ai/memu" target="_blank">MemU</a> for memory
+    </div>
+    """
 
 
 async def initialize_memu_service():
     """Initialize MemU memory service for memory storage."""
-    openai_api_key = os.getenv("OPENAI_API_KEY")
-    if not openai_api_key:
+    if not HAS_OPENAI:
         st.error("❌ OPENAI_API_KEY not found in environment variables.")
         st.info("Please add OPENAI_API_KEY to your .env file for MemU memory")
         return None
     
-    service = MemoryService(
-        llm_profiles={"default": {"api_key": openai_api_key}},
-        database_config={"metadata_store": {"provider": "inmemory"}},
-        retrieve_config={"method": "rag"},
-    )
-    return service
+    return shared_memu_service(OPENAI_API_KEY)
+
+
+def _anam_http() -> httpx.AsyncClient:
+    """
+    Async HTTP/2 client for the Anam API.
+    
+    httpx connections belong to the event loop that opened them, so the client
+    is kept for as long as the session's loop, closed along with it, and
+    rebuilt on a new one.
+    """
+    import httpx
+    
+    loop = asyncio.get_running_loop()
+    cached = st.session_state.get("_anam_http")
+    if cached is None or cached[0] is not loop:
+        client = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(ANAM_REQUEST_TIMEOUT, connect=ANAM_CONNECT_TIMEOUT),
+            headers={"Content-Type": "application/json"}
+        )
+        st.session_state._anam_http = (loop, client)
+        add_session_closer(client.aclose)
+    return st.session_state._anam_http[1]
 
 
-def get_anam_session_token(persona_config: dict) -> str:
+async def get_anam_session_token(persona_config: dict, api_key: str | None = ANAM_API_KEY) -> str:
     """
     Create a session token for Anam AI avatar.
     
     Args:
         persona_config: Configuration for the AI persona
+        api_key: Anam API key, defaulting to the one from the environment
         
     Returns:
         Session token string
     """
-    api_key = os.getenv("ANAM_API_KEY")
+    import httpx
+    
     if not api_key:
         st.error("❌ ANAM_API_KEY not found in environment variables.")
         return None
     
     try:
-        response = requests.post(
+        response = await _anam_http().post(
             "https://api.anam.ai/v1/auth/session-token",
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {api_key}"
-            },
-            json={"personaConfig": persona_config}
+            headers={"Authorization": f"Bearer {api_key}"},
+            content=orjson.dumps({"personaConfig": persona_config})
         )
         response.raise_for_status()
-        return response.json().get("sessionToken")
-    except requests.exceptions.RequestException as e:
+        return orjson.loads(response.content).get("sessionToken")
+    except (httpx.HTTPError, orjson.JSONDecodeError) as e:
         st.error(f"❌ Failed to get Anam session token: {e}")
         return None
 
 
-async def save_conversation_to_memory(memu_service: MemoryService, messages: list):
+@st.cache_resource(show_spinner=False)
+def _services_with_memories() -> set:
+    """(service id, user id) pairs that have memorized at least one conversation."""
+    return set()
+
+
+def save_conversation_to_memory(memu_service: MemoryService, messages: list, force_full: bool = False):
     """
-    Save conversation history to MemU memory.
+    Queue the messages added since the last save to be saved to MemU memory.
+    
+    The save runs on the MemU loop in the background; its future is kept in
+    st.session_state.pending_saves and reported by collect_finished_saves.
+    Progress is tracked by st.session_state.last_saved_message, the last
+    message handed to a save, so it stays valid when the bounded history
+    drops old turns. Only one save runs at a time, so callers check
+    pending_saves first.
     
     Args:
         memu_service: MemU service instance
-        messages: List of conversation messages
+        messages: Conversation messages (list or deque)
+        force_full: Re-memorize the whole history instead of only new messages
     
     Returns:
-        True if successful, False otherwise
+        True if the save was queued, False if there was nothing new to save
     """
-    if not messages or len(messages) < 2:
+    unsaved = unsaved_messages(messages, st.session_state.last_saved_message, force_full)
+    if len(unsaved) < 2:
         return False
     
-    try:
-        conversation = {"messages": []}
-        for msg in messages:
-            conversation["messages"].append({
-                "role": msg["role"],
-                "content": msg["content"]
-            })
-        
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as f:
-            json.dump(conversation, f)
-            temp_file = f.name
-        
-        try:
-            await memu_service.memorize(
-                resource_url=temp_file,
-                modality="conversation",
-                user={"user_id": "avatar_user"}
-            )
-        finally:
-            os.unlink(temp_file)
-        
-        return True
-    except Exception as e:
-        st.error(f"❌ Failed to save to memory: {e}")
-        return False
+    # Keep only what MemU memorizes; the copy is also a snapshot, so the save
+    # never sees later appends
+    delta = [{"role": msg["role"], "content": msg["content"]} for msg in unsaved]
+    user_id = st.session_state.memu_user_id
+    saved_services = _services_with_memories()
+    future = submit_memu(memorize_in_batches(
+        memu_service, delta, user_id, SAVE_BATCH_MESSAGES,
+        on_saved=lambda: saved_services.add((id(memu_service), user_id))
+    ))
+    # Invalidate as soon as the save finishes, so other sessions see the new
+    # memories without waiting for this session to rerun
+    context_cache, version = _memory_context_cache(), _memory_version()
+    
+    def invalidate_if_saved(done):
+        error = done.exception()
+        if error is None or getattr(error, "saved", 0):
+            _invalidate_memory_caches(context_cache, version)
+    
+    future.add_done_callback(invalidate_if_saved)
+    st.session_state.pending_saves.append((future, unsaved, st.session_state.last_saved_message))
+    st.session_state.last_saved_message = unsaved[-1]
+    return True
+
+
+def collect_finished_saves():
+    """Report background saves that completed since the previous run."""
+    still_running = []
+    for future, unsaved, previous in st.session_state.pending_saves:
+        if not future.done():
+            still_running.append((future, unsaved, previous))
+            continue
+        error = future.exception()
+        if error:
+            # Resume after the batches that did get memorized, so none is sent twice
+            st.session_state.last_saved_message = resume_marker(unsaved, previous, error)
+            st.toast(f"❌ Failed to save to memory: {error}")
+        else:
+            st.toast("✅ Conversation saved to MemU memory!")
+    st.session_state.pending_saves = still_running
+
+
+@st.cache_resource(show_spinner=False)
+def _memory_context_cache() -> dict:
+    """Process-wide cache of formatted memory contexts, keyed by (query, service id, user id)."""
+    return {}
+
+
+@st.cache_resource(show_spinner=False)
+def _memory_version() -> dict:
+    """Process-wide counter bumped whenever the stored memories change."""
+    return {"value": 0}
 
 
-async def get_memory_context(memu_service: MemoryService, query: str) -> str:
+def _invalidate_memory_caches(context_cache: dict, version: dict):
+    """
+    Forget cached memory contexts after the stored memories change.
+    
+    Takes the cached objects rather than looking them up, so finished saves
+    can call it from the MemU loop thread.
+    """
+    context_cache.clear()
+    version["value"] += 1
+
+
+async def get_memory_context(memu_service: MemoryService, query: str, user_id: str) -> str:
     """
     Retrieve relevant memory context for a query.
     
+    Results are cached for MEMORY_CONTEXT_TTL_SECONDS per query, service
+    instance and user, so repeated session starts skip the MemU round-trip.
+    Users that have not memorized anything yet return an empty context directly.
+    
     Args:
         memu_service: MemU service instance
         query: User's query
+        user_id: MemU user whose memories are searched
         
     Returns:
-        Memory context string
+        Memory context string, or None if the lookup failed
     """
+    # Nothing has been memorized yet, so there is nothing to search for
+    if (id(memu_service), user_id) not in _services_with_memories():
+        return ""
+    
+    cache = _memory_context_cache()
+    key = (query, id(memu_service), user_id)
+    cached = cache.get(key)
+    if cached and time.monotonic() - cached[0] < MEMORY_CONTEXT_TTL_SECONDS:
+        return cached[1]
+    
     try:
         queries = [{"role": "user", "content": {"text": query}}]
-        result = await memu_service.retrieve(queries=queries, where={"user_id": "avatar_user"})
+        result = await run_memu(memu_service.retrieve(queries=queries, where={"user_id": user_id}))
         
-        context_parts = []
-        for cat in result.get("categories", []):
-            summary = cat.get("summary", "")
-            if summary:
-                context_parts.append(f"- {summary}")
-        for item in result.get("items", []):
-            summary = item.get("summary", "")
-            if summary:
-                context_parts.append(f"- {summary}")
+        context_parts = [
+            f"- {summary}"
+            for group in ("categories", "items")
+            for entry in result.get(group, ())
+            if (summary := entry.get("summary"))
+        ]
         
-        return "\n".join(context_parts) if context_parts else ""
+        context = "\n".join(limit_context_parts(context_parts, MEMORY_CONTEXT_CHAR_BUDGET))
+        cache[key] = (time.monotonic(), context)
+        return context
     except Exception as e:
         st.warning(f"⚠️ Could not retrieve memory: {e}")
-        return ""
+        return None
 
 
-def build_system_prompt_with_memory(base_prompt: str, memory_context: str) -> str:
-    """
-    Build a system prompt that includes memory context.
-    
-    Args:
-        base_prompt: Base system prompt
-        memory_context: Retrieved memory context
-        
-    Returns:
-        Enhanced system prompt
-    """
+@st.cache_data(max_entries=64, show_spinner=False)
+def _render_prompt(base_prompt: str, memory_context: str) -> str:
+    """Compose the memory-augmented prompt, memoized on both inputs."""
     if memory_context:
         return f"""{base_prompt}
 
@@ -237,14 +438,22 @@ Use these memories to provide personalized, context-aware responses. Reference p
     return base_prompt
 
 
-def render_avatar_component(session_token: str):
+def build_system_prompt_with_memory(base_prompt: str, memory_context: str) -> str:
     """
-    Render the Anam AI avatar using embedded HTML/JS.
+    Build a system prompt that includes memory context.
     
     Args:
-        session_token: Anam session token
+        base_prompt: Base system prompt
+        memory_context: Retrieved memory context
+        
+    Returns:
+        Enhanced system prompt
     """
-    avatar_html = f"""
+    return _render_prompt(base_prompt, memory_context)
+
+
+# Embedded Anam client page; only the session token changes between renders
+_AVATAR_TEMPLATE_STR = """
     <div id="avatar-wrapper" style="width: 100%; max-width: 640px; margin: 0 auto;">
         <video 
             id="persona-video" 
@@ -269,87 +478,87 @@ def render_avatar_component(session_token: str):
     </div>
     
     <script type="module">
-        import {{ createClient, AnamEvent }} from "https://esm.sh/@anam-ai/js-sdk@latest";
+        import { createClient, AnamEvent } from "https://esm.sh/@anam-ai/js-sdk@latest";
         
-        const sessionToken = "{session_token}";
+        const sessionToken = "__SESSION_TOKEN__";
         const statusElement = document.getElementById("status");
         const transcriptElement = document.getElementById("transcript");
         
         let conversationLog = [];
         
-        function addToTranscript(role, text) {{
+        function addToTranscript(role, text) {
             const msgDiv = document.createElement("div");
             msgDiv.style.padding = "8px";
             msgDiv.style.marginBottom = "8px";
             msgDiv.style.borderRadius = "8px";
             
-            if (role === "user") {{
+            if (role === "user") {
                 msgDiv.style.background = "#e3f2fd";
                 msgDiv.style.textAlign = "right";
                 msgDiv.innerHTML = "<strong>You:</strong> " + text;
-            }} else {{
+            } else {
                 msgDiv.style.background = "#f5f5f5";
                 msgDiv.style.textAlign = "left";
                 msgDiv.innerHTML = "<strong>Avatar:</strong> " + text;
-            }}
+            }
             
             // Clear placeholder if first message
-            if (conversationLog.length === 0) {{
+            if (conversationLog.length === 0) {
                 transcriptElement.innerHTML = "";
-            }}
+            }
             
             transcriptElement.appendChild(msgDiv);
             transcriptElement.scrollTop = transcriptElement.scrollHeight;
             
-            conversationLog.push({{ role: role, content: text, timestamp: new Date().toISOString() }});
+            conversationLog.push({ role: role, content: text, timestamp: new Date().toISOString() });
             
             // Store in localStorage for Python to access
             localStorage.setItem("anam_conversation", JSON.stringify(conversationLog));
-        }}
+        }
         
-        async function startAvatar() {{
-            try {{
+        async function startAvatar() {
+            try {
                 statusElement.textContent = "Initializing avatar...";
                 statusElement.style.color = "#ffa726";
                 
                 const anamClient = createClient(sessionToken);
                 
                 // Set up event listeners using addListener and AnamEvent enum
-                anamClient.addListener(AnamEvent.CONNECTION_ESTABLISHED, () => {{
+                anamClient.addListener(AnamEvent.CONNECTION_ESTABLISHED, () => {
                     statusElement.textContent = "✅ Connected! Start speaking...";
                     statusElement.style.color = "#00c853";
-                }});
+                });
                 
-                anamClient.addListener(AnamEvent.CONNECTION_CLOSED, () => {{
+                anamClient.addListener(AnamEvent.CONNECTION_CLOSED, () => {
                     statusElement.textContent = "❌ Disconnected";
                     statusElement.style.color = "#ff5252";
-                }});
+                });
                 
-                anamClient.addListener(AnamEvent.VIDEO_PLAY_STARTED, () => {{
+                anamClient.addListener(AnamEvent.VIDEO_PLAY_STARTED, () => {
                     console.log("Video stream started");
-                }});
+                });
                 
                 // Listen for conversation updates (complete history)
-                anamClient.addListener(AnamEvent.MESSAGE_HISTORY_UPDATED, (messages) => {{
+                anamClient.addListener(AnamEvent.MESSAGE_HISTORY_UPDATED, (messages) => {
                     console.log("Conversation updated:", messages);
                     // Update transcript with full history
                     transcriptElement.innerHTML = "";
                     conversationLog = [];
-                    messages.forEach((msg) => {{
+                    messages.forEach((msg) => {
                         addToTranscript(msg.role === "assistant" ? "assistant" : "user", msg.content);
-                    }});
-                }});
+                    });
+                });
                 
                 // Listen for real-time transcription
-                anamClient.addListener(AnamEvent.MESSAGE_STREAM_EVENT_RECEIVED, (event) => {{
-                    if (event.type === "persona") {{
+                anamClient.addListener(AnamEvent.MESSAGE_STREAM_EVENT_RECEIVED, (event) => {
+                    if (event.type === "persona") {
                         // Persona speaking - could show real-time updates
                         console.log("Persona speaking:", event.text);
-                    }} else if (event.type === "user") {{
+                    } else if (event.type === "user") {
                         // User finished speaking
                         console.log("User said:", event.text);
-                    }}
-                }});
+                    }
+                });
                 
                 // Start streaming to video element
                 await anamClient.streamToVideoElement("persona-video");
@@ -357,92 +566,121 @@ def render_avatar_component(session_token: str):
                 statusElement.textContent = "✅ Connected! Start speaking...";
                 statusElement.style.color = "#00c853";
                 
-            }} catch (error) {{
+            } catch (error) {
                 console.error("Failed to start avatar:", error);
                 statusElement.textContent = "❌ Failed to connect: " + error.message;
                 statusElement.style.color = "#ff5252";
-            }}
-        }}
+            }
+        }
         
         // Auto-start when loaded
         startAvatar();
     </script>
     """
+_AVATAR_HTML_PRE, _AVATAR_HTML_POST = _AVATAR_TEMPLATE_STR.split("__SESSION_TOKEN__")
+
+
+def render_avatar_component(session_token: str):
+    """
+    Render the Anam AI avatar using embedded HTML/JS.
+    
+    Args:
+        session_token: Anam session token
+    """
+    avatar_html = _AVATAR_HTML_PRE + session_token + _AVATAR_HTML_POST
     
     st.components.v1.html(avatar_html, height=600, scrolling=True)
 
 
+def _memory_status_panel(enable_memory: bool):
+    """
+    Right-hand memory pane.
+    
+    main() runs it as a fragment that polls every SAVE_STATUS_POLL_SECONDS
+    while saves are pending, so their outcome shows without a full rerun.
+    """
+    had_pending = bool(st.session_state.pending_saves)
+    collect_finished_saves()
+    if had_pending and not st.session_state.pending_saves:
+        # Rerun the whole page so it sees the new memories and polling stops
+        st.rerun()
+    
+    st.subheader("🧠 Memory Status")
+    
+    if enable_memory:
+        if st.session_state.memory_initialized and st.session_state.memu_service:
+            st.info("""
+            **MemU Memory Active**
+            
+            Your conversations are being stored and will be used 
+            to provide personalized responses in future sessions.
+            """)
+            
+            # Memory stats (placeholder - actual implementation depends on MemU API)
+            with st.expander("📊 Memory Statistics"):
+                st.metric("Total Conversations", st.session_state.get("total_conversations", 0))
+                st.metric("Memory Items", st.session_state.get("memory_items", 0))
+                if st.session_state.pending_saves:
+                    st.caption(f"⏳ {len(st.session_state.pending_saves)} save(s) in progress")
+            
+            # Recent memories
+            with st.expander("📝 Recent Memories"):
+                history = st.session_state.get("conversation_history")
+                if history:
+                    for msg in itertools.islice(history, max(0, len(history) - 5), len(history)):
+                        role_icon = "👤" if msg["role"] == "user" else "🤖"
+                        st.write(f"{role_icon} {msg['content'][:100]}...")
+                else:
+                    st.write("No recent memories yet.")
+        else:
+            st.warning("Memory service not initialized. Click 'Initialize Memory Service' above.")
+    else:
+        st.warning("Memory is disabled. Enable it in the sidebar to store conversations.")
+    
+    st.divider()
+    
+    # Instructions
+    st.subheader("📖 How to Use")
+    st.markdown("""
+    1. **Initialize** memory service (if enabled)
+    2. **Configure** your avatar in the sidebar
+    3. **Start** the avatar session
+    4. **Speak** to interact with your AI avatar
+    5. **Save** conversations to build memory
+    
+    The avatar will remember past conversations
+    and provide personalized responses!
+    """)
+
+
 async def main():
     """Main async application entry point."""
+    _init_state()
     
-    # Header
-    st.markdown('<h1 class="main-header">🎭 AI Avatar with MemU Memory and Anam</h1>', unsafe_allow_html=True)
-    st.markdown("""
-    <p style="text-align: center; color: #666; font-size: 1.1rem;">
-        Interactive AI Avatar powered by Anam AI with persistent memory via MemU
-    </p>
-    """, unsafe_allow_html=True)
+    # Styles and header in one element; Streamlit drops elements that are not
+    # re-emitted, so this still goes out every run
+    st.html(_CSS + _HEADER_HTML)
+    
+    # Pick up background saves first so memory caches are fresh for this run
+    collect_finished_saves()
     
     # Sidebar configuration
     with st.sidebar:
         st.header("⚙️ Avatar Configuration")
         
         # Avatar selection
-        avatar_options = {
-            "Cara (Default)": "30fa96d0-26c4-4e55-94a0-517025942e18",
-            "Richard": "richard-avatar-id",
-            "Ben": "ben-avatar-id",
-            "Liv": "liv-avatar-id",
-            "Custom": "custom"
-        }
-        selected_avatar = st.selectbox("Select Avatar", list(avatar_options.keys()))
+        selected_avatar = st.selectbox("Select Avatar", AVATAR_LIST)
         
         # Voice selection
-        voice_options = {
-            "Default Voice": "6bfbe25a-979d-40f3-a92b-5394170af54b",
-            "Custom": "custom"
-        }
-        selected_voice = st.selectbox("Select Voice", list(voice_options.keys()))
+        selected_voice = st.selectbox("Select Voice", VOICE_LIST)
         
         # Persona name
         persona_name = st.text_input("Persona Name", value="Maya")
         
         # System prompt
-        default_prompt = """You are Maya, a friendly and helpful AI doctor’s assistant. Your role is to check the user's current medications, ask proactively about the last medications they've taken (using memory or prior user history if available), and provide assistance or reminders as needed.
-
-- Always respond in a warm, conversational manner appropriate for a healthcare assistant.
-- Use empathetic language and active listening techniques to build rapport with the user.
-- Be concise and clear in your communication.
-- When interacting with a user, first recall and mention any medications mentioned or logged previously (if such data exists).
-- Proactively ask the user about their last medications: inquire about times taken, missed doses, changes, or any side effects.
-- Offer to help log new medications, remind about dosage or schedules, and answer related questions.
-- Do not give direct clinical advice or prescription suggestions—instead, guide the user to consult a healthcare professional for such needs.
-- If no memory or medication history is present, gently prompt the user to share their current medications.
-- If the user mentions changes in medication or new symptoms, ask for clarifying details and offer supportive suggestions (e.g., tracking, discussing with their doctor, etc.).
-
-**Output Format:**  
-Always respond in concise, friendly conversational English, suitable for a chat interface. Limit replies to 2-4 short paragraphs.
-
-**Examples:**
-
-**Example 1:**  
-_User’s medication memory_: “Last logged: Lisinopril 10mg at 8am.”  
-Maya: “Welcome back Sudhanshu! I see you last took Lisinopril 10mg at 8am. Have you taken your next dose yet, or are there any changes to your medication plan? If you’ve experienced any side effects, let me know so I can help keep track for you!”
-
-**Example 2:**  
-_(No medication memory found)_  
-Maya: “Hi Sudhanshu! I don’t have any medications logged for you yet. Can you tell me what medications you’re currently taking? I can help you track your schedule and remind you if you’d like.”
-
-**Example 3:**  
-_User: “I missed my last dose of metformin.”_  
-Maya: “Thank you for letting me know you missed your last dose of metformin. Would you like me to remind you about your next dose, or help you log your medication times more regularly? Always let your doctor know about any missed doses, especially if you feel unwell.”
-
-**Important Reminder:**  
-You are a proactive and friendly AI doctor assistant. Always check or recall the user’s medication history if available, ask about current or recent medication use, and offer appropriate, non-clinical assistance. Never give medical advice—prompt users to contact their healthcare provider for medical concerns."""
-        
         system_prompt = st.text_area(
             "System Prompt",
-            value=default_prompt,
+            value=DEFAULT_SYSTEM_PROMPT,
             height=150
         )
         
@@ -451,24 +689,46 @@ You are a proactive and friendly AI doctor assistant. Always check or recall the
         # Memory controls
         st.header("🧠 Memory Settings")
         enable_memory = st.checkbox("Enable MemU Memory", value=True)
+        force_full_save = False
         
         if enable_memory:
-            if st.button("🗑️ Clear Memory"):
+            force_full_save = st.checkbox(
+                "Force full re-memorize",
+                value=False,
+                help="Save the whole conversation again instead of only new messages (for debugging)"
+            )
+            # A save still running would keep writing under the current user
+            # after the clear, so clearing waits until it has finished
+            saving = bool(st.session_state.pending_saves)
+            if st.button(
+                "🗑️ Clear Memory",
+                disabled=saving,
+                help="Available once the running save finishes" if saving else None
+            ):
                 if "conversation_history" in st.session_state:
-                    st.session_state.conversation_history = []
+                    st.session_state.conversation_history = deque(maxlen=MAX_HISTORY_MESSAGES)
+                st.session_state.last_saved_message = None
+                user_id = st.session_state.memu_user_id
+                if st.session_state.memu_service:
+                    # The service is shared, so only this session's memories are deleted
+                    try:
+                        await run_memu(st.session_state.memu_service.clear_memory(where={"user_id": user_id}))
+                    except Exception as e:
+                        st.warning(f"⚠️ Could not clear stored memories: {e}")
+                    _services_with_memories().discard((id(st.session_state.memu_service), user_id))
+                # Later saves go to a fresh user id
+                st.session_state.memu_user_id = uuid.uuid4().hex
                 st.session_state.memory_initialized = False
                 st.session_state.memu_service = None
+                _invalidate_memory_caches(_memory_context_cache(), _memory_version())
                 st.success("Memory cleared!")
         
         st.divider()
         
         # API Key status
         st.header("🔑 API Status")
-        anam_key = os.getenv("ANAM_API_KEY")
-        openai_key = os.getenv("OPENAI_API_KEY")
-        
-        st.write("ANAM_API_KEY:", "✅ Set" if anam_key else "❌ Missing")
-        st.write("OPENAI_API_KEY:", "✅ Set" if openai_key else "❌ Missing")
+        st.write("ANAM_API_KEY:", "✅ Set" if HAS_ANAM else "❌ Missing")
+        st.write("OPENAI_API_KEY:", "✅ Set" if HAS_OPENAI else "❌ Missing")
     
     # Initialize MemU service if memory is enabled and not yet initialized
     if enable_memory and not st.session_state.memory_initialized:
@@ -488,7 +748,7 @@ You are a proactive and friendly AI doctor assistant. Always check or recall the
         st.subheader("🎬 AI Avatar")
         
         # Check for API keys
-        if not os.getenv("ANAM_API_KEY"):
+        if not HAS_ANAM:
             st.error("""
             ❌ **ANAM_API_KEY not found!**
             
@@ -503,32 +763,52 @@ You are a proactive and friendly AI doctor assistant. Always check or recall the
             # Initialize avatar session
             if st.button("🚀 Start Avatar Session", type="primary", use_container_width=True):
                 with st.spinner("Initializing avatar..."):
-                    # Get memory context if enabled
-                    memory_context = ""
-                    if enable_memory and st.session_state.memu_service:
-                        memory_context = await get_memory_context(
-                            st.session_state.memu_service, 
-                            "general conversation context"
-                        )
+                    avatar_id = AVATAR_OPTIONS.get(selected_avatar, AVATAR_OPTIONS["Cara (Default)"])
+                    voice_id = VOICE_OPTIONS.get(selected_voice, VOICE_OPTIONS["Default Voice"])
+                    use_memory = bool(enable_memory and st.session_state.memu_service)
                     
-                    # Build enhanced system prompt
-                    enhanced_prompt = build_system_prompt_with_memory(
-                        system_prompt, 
-                        memory_context
-                    )
+                    # Reuse the prompt built for an unchanged configuration and memory state
+                    cfg_key = hashlib.md5(repr((
+                        system_prompt, avatar_id, voice_id, persona_name, use_memory,
+                        id(st.session_state.memu_service), st.session_state.memu_user_id,
+                        _memory_version()["value"]
+                    )).encode()).hexdigest()
                     
-                    # Configure persona
-                    persona_config = {
-                        "name": persona_name,
-                        "avatarId": avatar_options.get(selected_avatar, avatar_options["Cara (Default)"]),
-                        "voiceId": voice_options.get(selected_voice, voice_options["Default Voice"]),
-                        "llmId": "0934d97d-0c3a-4f33-91b0-5e136a0ef466",
-                        "systemPrompt": enhanced_prompt,
-                        "maxSessionLengthSeconds": 600
-                    }
+                    if st.session_state.get("cfg_key") != cfg_key or "enhanced_prompt" not in st.session_state:
+                        # Get memory context if enabled
+                        memory_context = ""
+                        if use_memory:
+                            memory_context = await get_memory_context(
+                                st.session_state.memu_service, 
+                                "general conversation context",
+                                st.session_state.memu_user_id
+                            )
+                        retrieved = memory_context is not None
+                        memory_context = memory_context or ""
+                        
+                        # Build enhanced system prompt
+                        enhanced_prompt = build_system_prompt_with_memory(
+                            system_prompt, 
+                            memory_context
+                        )
+                        
+                        # Configure persona
+                        st.session_state.persona_config = {
+                            "name": persona_name,
+                            "avatarId": avatar_id,
+                            "voiceId": voice_id,
+                            "llmId": "0934d97d-0c3a-4f33-91b0-5e136a0ef466",
+                            "systemPrompt": enhanced_prompt,
+                            "maxSessionLengthSeconds": 600
+                        }
+                        st.session_state.memory_context = memory_context
+                        st.session_state.enhanced_prompt = enhanced_prompt
+                        # A prompt built without its memories is not reused, so the next start retries
+                        st.session_state.cfg_key = cfg_key if retrieved else None
                     
-                    # Get session token
-                    session_token = get_anam_session_token(persona_config)
+                    # An explicit start always gets a fresh token, so a dropped or
+                    # failed avatar connection can be restarted
+                    session_token = await get_anam_session_token(st.session_state.persona_config)
                     
                     if session_token:
                         st.session_state.avatar_active = True
@@ -542,70 +822,29 @@ You are a proactive and friendly AI doctor assistant. Always check or recall the
                 # Save conversation button
                 if enable_memory and st.session_state.memu_service:
                     if st.button("💾 Save Conversation to Memory"):
-                        if "conversation_history" in st.session_state and st.session_state.conversation_history:
-                            success = await save_conversation_to_memory(
+                        if st.session_state.pending_saves:
+                            st.warning("A save is still running. Try again once it finishes.")
+                        elif "conversation_history" in st.session_state and st.session_state.conversation_history:
+                            queued = save_conversation_to_memory(
                                 st.session_state.memu_service, 
-                                st.session_state.conversation_history
+                                st.session_state.conversation_history,
+                                force_full=force_full_save
                             )
-                            if success:
-                                st.success("✅ Conversation saved to MemU memory!")
+                            if queued:
+                                st.success("✅ Saving conversation to MemU memory in the background...")
+                            else:
+                                st.warning("No new messages since the last save.")
                         else:
                             st.warning("No conversation to save yet.")
     
     with col2:
-        st.subheader("🧠 Memory Status")
-        
-        if enable_memory:
-            if st.session_state.memory_initialized and st.session_state.memu_service:
-                st.info("""
-                **MemU Memory Active**
-                
-                Your conversations are being stored and will be used 
-                to provide personalized responses in future sessions.
-                """)
-                
-                # Memory stats (placeholder - actual implementation depends on MemU API)
-                with st.expander("📊 Memory Statistics"):
-                    st.metric("Total Conversations", st.session_state.get("total_conversations", 0))
-                    st.metric("Memory Items", st.session_state.get("memory_items", 0))
-                
-                # Recent memories
-                with st.expander("📝 Recent Memories"):
-                    if "conversation_history" in st.session_state and st.session_state.conversation_history:
-                        for msg in st.session_state.conversation_history[-5:]:
-                            role_icon = "👤" if msg["role"] == "user" else "🤖"
-                            st.write(f"{role_icon} {msg['content'][:100]}...")
-                    else:
-                        st.write("No recent memories yet.")
-            else:
-                st.warning("Memory service not initialized. Click 'Initialize Memory Service' above.")
-        else:
-            st.warning("Memory is disabled. Enable it in the sidebar to store conversations.")
-        
-        st.divider()
-        
-        # Instructions
-        st.subheader("📖 How to Use")
-        st.markdown("""
-        1. **Initialize** memory service (if enabled)
-        2. **Configure** your avatar in the sidebar
-        3. **Start** the avatar session
-        4. **Speak** to interact with your AI avatar
-        5. **Save** conversations to build memory
-        
-        The avatar will remember past conversations
-        and provide personalized responses!
-        """)
+        run_every = SAVE_STATUS_POLL_SECONDS if st.session_state.pending_saves else None
+        st.fragment(_memory_status_panel, run_every=run_every)(enable_memory)
     
     # Footer
     st.divider()
-    st.markdown("""
-    <div style="text-align: center; color: #999; font-size: 0.9rem;">
-        Powered by <a href="https://anam.ai" target="_blank">Anam AI</a> for avatars 
-        and <a href="https://github.com/memu-ai/memu" target="_blank">MemU</a> for memory
-    </div>
-    """, unsafe_allow_html=True)
+    st.html(_FOOTER_HTML)
 
 
 # Run the async main function
-asyncio.run(main())
+get_session_loop().run_until_complete(main())
@@ -0,0 +1,271 @@
+"""
+Shared MemU helpers for the Streamlit apps in this repository.
+"""
+
+import asyncio
+import concurrent.futures
+import itertools
+import logging
+import os
+import tempfile
+import threading
+import weakref
+
+import orjson
+import streamlit as st
+
+logger = logging.getLogger(__name__)
+
+
+def memu_service_kwargs(openai_api_key: str) -> dict:
+    """
+    MemoryService settings shared by both apps.
+
+    Storage and retrieval are configured here so a different metadata store
+    or retrieval method only has to be set in one place.
+
+    Args:
+        openai_api_key: Key MemU uses for extraction and embeddings
+
+    Returns:
+        Keyword arguments for MemoryService
+    """
+    return {
+        "llm_profiles": {"default": {"api_key": openai_api_key}},
+        "database_config": {"metadata_store": {"provider": "inmemory"}},
+        "retrieve_config": {"method": "rag"},
+    }
+
+
+@st.cache_resource(show_spinner=False)
+def shared_memu_service(openai_api_key: str):
+    """Create the MemU service once and share it across sessions and reruns."""
+    # Imported on first use, once per process, so this module also loads
+    # without MemU installed, as in the offline tests
+    from memu.app import MemoryService
+
+    return MemoryService(**memu_service_kwargs(openai_api_key))
+
+
+@st.cache_resource(show_spinner=False)
+def _memu_loop() -> asyncio.AbstractEventLoop:
+    """
+    Event loop on a daemon thread that runs every MemU call in the process.
+
+    The shared MemoryService keeps its OpenAI clients, and their pooled httpx
+    connections, for as long as the process. Those connections belong to the
+    loop that opened them, so every MemU coroutine runs on this one loop.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="memu-loop", daemon=True).start()
+    return loop
+
+
+def submit_memu(coro) -> concurrent.futures.Future:
+    """Schedule a MemU coroutine on the MemU loop from any thread and return its future."""
+    return asyncio.run_coroutine_threadsafe(coro, _memu_loop())
+
+
+async def run_memu(work):
+    """
+    Await MemU work from any event loop.
+
+    Args:
+        work: A coroutine, which is scheduled on the MemU loop, or a future
+            returned by submit_memu
+
+    Returns:
+        The coroutine's result
+    """
+    if asyncio.iscoroutine(work):
+        work = submit_memu(work)
+    return await asyncio.wrap_future(work)
+
+
+async def memorize_conversation(service, messages: list, user_id: str) -> dict:
+    """
+    Memorize a list of conversation messages with MemU.
+
+    MemU's memorize() only accepts a resource URL (a local path or HTTP URL),
+    so the messages are written to a short-lived JSON file that MemU copies
+    into its own resource store.
+
+    Args:
+        service: MemU MemoryService instance
+        messages: Conversation messages with "role" and "content" keys
+        user_id: MemU user the memories belong to
+
+    Returns:
+        The memorize() result
+    """
+    with tempfile.NamedTemporaryFile(mode='wb', suffix='.json', delete=False) as f:
+        f.write(orjson.dumps({"messages": messages}))
+        temp_file = f.name
+
+    try:
+        return await service.memorize(
+            resource_url=temp_file,
+            modality="conversation",
+            user={"user_id": user_id}
+        )
+    finally:
+        os.unlink(temp_file)
+
+
+class SaveError(Exception):
+    """A save that failed after memorizing its first `saved` messages."""
+
+    def __init__(self, saved: int, cause: Exception):
+        super().__init__(f"{cause} ({saved} message(s) were saved before the failure)")
+        self.saved = saved
+
+
+async def memorize_in_batches(service, messages: list, user_id: str, batch_size: int, on_saved=None):
+    """
+    Memorize messages in order, `batch_size` at a time.
+
+    A failure leaves a saved prefix, whose length is reported through
+    SaveError so the next save can skip it.
+
+    Args:
+        service: MemU MemoryService instance
+        messages: Conversation messages with "role" and "content" keys
+        user_id: MemU user the memories belong to
+        batch_size: Largest number of messages per memorize call
+        on_saved: Called after each batch that was memorized
+    """
+    saved = 0
+    for start in range(0, len(messages), batch_size):
+        batch = messages[start:start + batch_size]
+        try:
+            await memorize_conversation(service, batch, user_id)
+        except Exception as e:
+            raise SaveError(saved, e) from e
+        saved += len(batch)
+        if on_saved is not None:
+            on_saved()
+
+
+def unsaved_messages(messages, marker, force_full: bool = False) -> list:
+    """
+    Messages after `marker`, the last message handed to a save.
+
+    The marker is matched by identity, so it stays valid when a bounded
+    history drops old turns. All messages are returned if it is no longer in
+    the history, if there is none yet, or if `force_full` is set.
+    """
+    if marker is not None and not force_full:
+        for offset, msg in enumerate(reversed(messages)):
+            if msg is marker:
+                return list(itertools.islice(messages, len(messages) - offset, len(messages)))
+    return list(messages)
+
+
+def resume_marker(unsaved: list, previous, error: Exception):
+    """
+    Marker to resume from after a save of `unsaved` failed with `error`.
+
+    Messages memorized before the failure are not sent again; if none were,
+    the save is retried in full from `previous`, the marker it started from.
+    """
+    saved = getattr(error, "saved", 0)
+    return unsaved[saved - 1] if saved else previous
+
+
+def limit_context_parts(context_parts: list, budget: int) -> list:
+    """
+    Drop repeated snippets and fit the rest, one per line, into `budget` characters.
+
+    Snippets are kept whole while they fit. The first one that does not is
+    cut to the space left and marked with an ellipsis, so a single long
+    category summary still leaves a usable context.
+
+    Args:
+        context_parts: Memory snippets in priority order
+        budget: Largest length of the newline-joined result
+
+    Returns:
+        The snippets to join
+    """
+    kept = []
+    # Length of the joined result so far; the first snippet needs no newline
+    used = -1
+    for part in dict.fromkeys(context_parts):
+        room = budget - used - 1
+        if len(part) > room:
+            if room > 1:
+                kept.append(part[:room - 1].rstrip() + "…")
+            break
+        kept.append(part)
+        used += len(part) + 1
+    return kept
+
+
+def close_loop(loop: asyncio.AbstractEventLoop, timeout: float = 1.0, closers=()):
+    """
+    Run a loop's cleanups, give its pending tasks up to `timeout` seconds to
+    finish, cancel the rest and close the loop. Loops that are closed or
+    still running are left alone.
+
+    Args:
+        loop: Event loop to shut down
+        timeout: Seconds each cleanup and the pending tasks may take
+        closers: Async callables, such as an HTTP client's aclose, awaited first
+    """
+    if loop.is_closed() or loop.is_running():
+        return
+    for aclose in closers:
+        try:
+            loop.run_until_complete(asyncio.wait_for(aclose(), timeout))
+        except Exception:
+            logger.warning("Cleanup failed while closing an event loop", exc_info=True)
+    pending = asyncio.all_tasks(loop)
+    if pending:
+        loop.run_until_complete(asyncio.wait(pending, timeout=timeout))
+        for task in pending:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+    loop.run_until_complete(loop.shutdown_asyncgens())
+    loop.close()
+
+
+def _close_session_loop(loop: asyncio.AbstractEventLoop, closers: list):
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        close_loop(loop, closers=closers)
+    else:
+        # Streamlit's server thread is already running a loop and cannot run another
+        threading.Thread(target=close_loop, args=(loop,), kwargs={"closers": closers}, daemon=True).start()
+
+
+class _SessionLoop:
+    """A session's event loop and the cleanups to await before it is closed."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.closers: list = []
+        # Fires when Streamlit drops the session state holding this object,
+        # or at interpreter exit for sessions still alive then
+        weakref.finalize(self, _close_session_loop, self.loop, self.closers)
+
+
+def get_session_loop() -> asyncio.AbstractEventLoop:
+    """
+    Event loop reused across the current session's reruns.
+
+    asyncio.run() would build and tear down a loop on every rerun, closing
+    loop-bound clients with it. This loop is closed, after the cleanups
+    registered with add_session_closer, once the session ends.
+    """
+    handle = st.session_state.get("_session_loop")
+    if handle is None or handle.loop.is_closed() or handle.loop.is_running():
+        handle = _SessionLoop()
+        st.session_state._session_loop = handle
+    asyncio.set_event_loop(handle.loop)
+    return handle.loop
+
+
+def add_session_closer(aclose):
+    """Await `aclose()` on the session's loop before that loop is closed."""
+    st.session_state._session_loop.closers.append(aclose)
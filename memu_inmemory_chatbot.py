@@ -1,11 +1,11 @@
 import os
 import streamlit as st
 from dotenv import load_dotenv
-from memu.app import MemoryService
 from openai import OpenAI
-import asyncio
-import tempfile
-import json
+import threading
+import time
+import uuid
+from memory_utils import get_session_loop, memorize_conversation, run_memu, shared_memu_service, submit_memu
 
 st.title("MemU Chatbot Demo 🧠")
 st.caption("Interactive chatbot demonstrating MemU memory retrieval from a sample conversation.")
@@ -24,8 +24,19 @@ if not os.path.exists(file_path):
     st.error(f"Example file not found: {file_path}. Please ensure 'example/example_conversation.json' exists.")
     st.stop()
 
+# Minimum seconds between OpenRouter connection warm-ups
+PREWARM_INTERVAL_SECONDS = 5
+
+# MemU user that owns the example conversation, shared by every session
+EXAMPLE_USER_ID = "123"
+
+@st.cache_resource(show_spinner=False)
+def _openrouter_client(openrouter_api_key: str) -> OpenAI:
+    """OpenRouter client shared across reruns so its connection pool stays warm."""
+    return OpenAI(base_url="https://openrouter.ai/api/v1", api_key=openrouter_api_key)
+
 # Initialize OpenRouter client
-client = OpenAI(base_url="https://openrouter.ai/api/v1", api_key=openrouter_api_key)
+client = _openrouter_client(openrouter_api_key)
 
 # Session state initialization
 if "messages" not in st.session_state:
@@ -36,44 +47,123 @@ if "service" not in st.session_state:
     st.session_state.service = None
 if "pending_prompt" not in st.session_state:
     st.session_state.pending_prompt = None
+if "last_prewarm_ts" not in st.session_state:
+    st.session_state.last_prewarm_ts = 0.0
+if "user_id" not in st.session_state:
+    # The MemU service is shared, so each session memorizes its turns under its own user
+    st.session_state.user_id = uuid.uuid4().hex
+
+@st.cache_resource(show_spinner=False)
+def _example_memory() -> dict:
+    """Futures of the example conversation's memorize, keyed by service id."""
+    return {}
+
+@st.cache_resource(show_spinner=False)
+def _example_memory_lock() -> threading.Lock:
+    """Guards starting the one-time memorize of the example conversation."""
+    return threading.Lock()
+
+def _example_memorized(service) -> bool:
+    """Whether the example conversation was memorized into this service."""
+    future = _example_memory().get(id(service))
+    return future is not None and future.done() and future.exception() is None
 
 async def initialize_and_load_memory():
-    """Initialize service and load memory - runs once."""
-    service = MemoryService(
-        llm_profiles={"default": {"api_key": openai_api_key}},
-        database_config={"metadata_store": {"provider": "inmemory"}},
-        retrieve_config={"method": "rag"},
-    )
-    memory = await service.memorize(resource_url=file_path, modality="conversation", user={"user_id": "123"})
-    return service, memory
+    """Get the shared service, memorizing the example conversation on first use."""
+    service = shared_memu_service(openai_api_key)
+    loaded = _example_memory()
+    # Sessions that load at the same time share one memorize on the MemU loop;
+    # the lock only covers starting it, and a failed one is started again
+    with _example_memory_lock():
+        future = loaded.get(id(service))
+        if future is None or (future.done() and future.exception() is not None):
+            future = loaded[id(service)] = submit_memu(
+                service.memorize(resource_url=file_path, modality="conversation", user={"user_id": EXAMPLE_USER_ID})
+            )
+    return service, await run_memu(future)
+
+def _warm_up_openrouter():
+    """Open the OpenRouter connection with a tiny authenticated request; errors only cost the connect later."""
+    try:
+        client.with_options(max_retries=0, timeout=5).get("/key", cast_to=object)
+    except Exception:
+        pass
 
 async def generate_response(service, prompt):
-    """Retrieve memory and generate a response using LLM."""
+    """Retrieve memory and start a streamed LLM response; returns an iterator of text deltas."""
+    # Every turn memorizes new messages, so earlier retrievals never apply to
+    # the next one and the query goes straight to MemU
     queries = [{"role": "user", "content": {"text": prompt}}]
-    result = await service.retrieve(queries=queries, where={"user_id": "123"})
+    # Search the shared example conversation and this session's own turns
+    where = {"user_id__in": [EXAMPLE_USER_ID, st.session_state.user_id]}
+    
+    # Open the OpenRouter connection while retrieval runs, unless it was warmed
+    # recently; the reply never waits on it
+    now = time.monotonic()
+    if now - st.session_state.last_prewarm_ts >= PREWARM_INTERVAL_SECONDS:
+        st.session_state.last_prewarm_ts = now
+        threading.Thread(target=_warm_up_openrouter, daemon=True).start()
+    
+    result = await run_memu(service.retrieve(queries=queries, where=where))
     
     # Build context from retrieved memory
-    context = "Relevant past information:\n"
-    for cat in result.get("categories", []):
-        context += f"- {cat.get('summary', '')}\n"
-    for item in result.get("items", []):
-        context += f"- {item.get('summary', '')}\n"
+    body = "\n".join(
+        f"- {summary}"
+        for group in ("categories", "items")
+        for entry in result.get(group, ())
+        if (summary := entry.get("summary"))
+    )
+    context = f"Relevant past information:\n{body}\n"
     
     # Prepare the full prompt
     full_prompt = f"{context}\nHuman: {prompt}\nAI:"
     
-    # Generate response using OpenRouter
-    response = client.chat.completions.create(
+    # Generate response using OpenRouter, streamed so the reply paints as it arrives
+    stream = client.chat.completions.create(
         model="gpt-4o",
         messages=[
             {"role": "system", "content": "You are a helpful assistant with access to past conversations."},
             {"role": "user", "content": full_prompt}
-        ]
+        ],
+        stream=True
     )
-    return response.choices[0].message.content
+
+    def token_iter():
+        for chunk in stream:
+            if chunk.choices and (delta := chunk.choices[0].delta.content):
+                yield delta
+
+    return token_iter()
+
+async def turn(service, prompt):
+    """
+    One chat turn: retrieve and stream the reply, then memorize the exchange.
+
+    The user and assistant messages go to MemU in a single memorize call.
+    Retrieval and memorize still each do their own embedding work inside MemU.
+    """
+    with st.spinner("Generating response..."):
+        stream = await generate_response(service, prompt)
+    with st.chat_message("assistant"):
+        response = st.write_stream(stream)
+    st.session_state.messages.append({"role": "assistant", "content": response})
+
+    # Add the conversation to memory
+    with st.spinner("Saving to memory..."):
+        await run_memu(memorize_conversation(
+            service,
+            [{"role": "user", "content": prompt}, {"role": "assistant", "content": response}],
+            st.session_state.user_id,
+        ))
+    return response
 
 async def main():
     """Main async function that handles all MemU operations."""
+    # Sessions started after the example was memorized can use it straight away
+    if not st.session_state.memory_loaded and _example_memorized(shared_memu_service(openai_api_key)):
+        st.session_state.service = shared_memu_service(openai_api_key)
+        st.session_state.memory_loaded = True
+
     # Load memory if not already loaded
     if not st.session_state.memory_loaded:
         if st.button("Load Memory Data"):
@@ -100,27 +190,7 @@ async def main():
         with st.chat_message("user"):
             st.markdown(prompt)
 
-        with st.spinner("Generating response..."):
-            response = await generate_response(st.session_state.service, prompt)
-
-        # Add the conversation to memory
-        conversation = {
-            "messages": [
-                {"role": "user", "content": prompt},
-                {"role": "assistant", "content": response}
-            ]
-        }
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as f:
-            json.dump(conversation, f)
-            temp_file = f.name
-        try:
-            await st.session_state.service.memorize(resource_url=temp_file, modality="conversation", user={"user_id": "123"})
-        finally:
-            os.unlink(temp_file)
-
-        st.session_state.messages.append({"role": "assistant", "content": response})
-        with st.chat_message("assistant"):
-            st.markdown(response)
+        await turn(st.session_state.service, prompt)
 
 # Run the async main function
-asyncio.run(main())
+get_session_loop().run_until_complete(main())
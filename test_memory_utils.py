@@ -0,0 +1,180 @@
+"""Offline tests for memory_utils, using a stub MemU client."""
+
+import asyncio
+import os
+from collections import deque
+
+import orjson
+import pytest
+
+from memory_utils import (
+    SaveError,
+    close_loop,
+    limit_context_parts,
+    memorize_conversation,
+    memorize_in_batches,
+    resume_marker,
+    run_memu,
+    submit_memu,
+    unsaved_messages,
+)
+
+
+class StubService:
+    """Stands in for MemoryService; records memorize() calls."""
+
+    def __init__(self, fail_on_call: int | None = None):
+        self.memorized = []
+        self.fail_on_call = fail_on_call
+
+    async def memorize(self, resource_url, modality, user):
+        if len(self.memorized) == self.fail_on_call:
+            raise RuntimeError("memorize failed")
+        with open(resource_url, "rb") as f:
+            self.memorized.append((orjson.loads(f.read()), modality, user, resource_url))
+        return {}
+
+
+def test_memorize_conversation_sends_messages_and_removes_the_file():
+    service = StubService()
+    messages = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}]
+
+    asyncio.run(memorize_conversation(service, messages, "u1"))
+
+    payload, modality, user, path = service.memorized[0]
+    assert payload == {"messages": messages}
+    assert modality == "conversation"
+    assert user == {"user_id": "u1"}
+    assert not os.path.exists(path)
+
+
+def test_close_loop_runs_closers_and_settles_tasks():
+    loop = asyncio.new_event_loop()
+    closed = []
+
+    async def aclose():
+        closed.append(True)
+
+    quick = loop.create_task(asyncio.sleep(0.01))
+    stuck = loop.create_task(asyncio.sleep(60))
+
+    close_loop(loop, timeout=0.2, closers=[aclose])
+
+    assert closed == [True]
+    assert quick.done() and not quick.cancelled()
+    assert stuck.cancelled()
+    assert loop.is_closed()
+
+
+def test_close_loop_survives_a_failing_closer():
+    loop = asyncio.new_event_loop()
+
+    async def aclose():
+        raise RuntimeError("already closed")
+
+    close_loop(loop, closers=[aclose])
+    assert loop.is_closed()
+
+
+def test_memu_work_shares_one_loop_across_callers():
+    async def current_loop():
+        return asyncio.get_running_loop()
+
+    first = asyncio.run(run_memu(current_loop()))
+    second = asyncio.run(run_memu(current_loop()))
+    submitted = submit_memu(current_loop())
+
+    assert first is second is submitted.result(timeout=2)
+    assert first.is_running()
+    assert asyncio.run(run_memu(submit_memu(asyncio.sleep(0, result="done")))) == "done"
+
+
+def test_context_parts_fit_the_budget_whole_then_truncated():
+    parts = ["- " + "a" * 8, "- " + "b" * 8, "- " + "a" * 8, "- " + "c" * 30, "- d"]
+
+    kept = limit_context_parts(parts, 30)
+
+    assert kept[:2] == ["- aaaaaaaa", "- bbbbbbbb"]
+    assert kept[2].startswith("- ccc") and kept[2].endswith("…")
+    assert len(kept) == 3
+    assert len("\n".join(kept)) == 30
+
+
+def test_single_long_summary_still_gives_a_context():
+    kept = limit_context_parts(["- " + "x" * 5000, "- item"], 2000)
+
+    assert len(kept) == 1
+    assert 0 < len(kept[0]) <= 2000
+    assert limit_context_parts([], 2000) == []
+
+
+def conversation(count):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"m{i}"} for i in range(count)]
+
+
+def test_unsaved_messages_follow_the_marker():
+    history = conversation(6)
+
+    assert unsaved_messages(history, None) == history
+    assert unsaved_messages(history, history[3]) == history[4:]
+    assert unsaved_messages(history, history[-1]) == []
+
+
+def test_unsaved_messages_match_the_marker_by_identity():
+    history = conversation(4)
+    lookalike = dict(history[1])
+
+    assert unsaved_messages(history, lookalike) == history
+
+
+def test_marker_evicted_from_a_bounded_history_saves_everything():
+    history = deque(conversation(4), maxlen=4)
+    marker = history[0]
+    history.extend(conversation(2))
+
+    assert all(msg is not marker for msg in history)
+    assert unsaved_messages(history, marker) == list(history)
+
+
+def test_force_full_ignores_the_marker():
+    history = deque(conversation(6), maxlen=10)
+
+    assert unsaved_messages(history, history[3], force_full=True) == list(history)
+
+
+def test_partial_failure_resumes_after_the_saved_batches():
+    service = StubService(fail_on_call=1)
+    history = conversation(5)
+    saved_batches = []
+
+    with pytest.raises(SaveError) as raised:
+        asyncio.run(memorize_in_batches(service, history, "u1", 2, on_saved=lambda: saved_batches.append(1)))
+
+    assert raised.value.saved == 2
+    assert len(saved_batches) == 1
+    marker = resume_marker(history, None, raised.value)
+    assert marker is history[1]
+    assert unsaved_messages(history, marker) == history[2:]
+
+
+def test_failure_before_any_batch_resumes_from_the_previous_marker():
+    service = StubService(fail_on_call=0)
+    history = conversation(6)
+    previous = history[1]
+    unsaved = unsaved_messages(history, previous)
+
+    with pytest.raises(SaveError) as raised:
+        asyncio.run(memorize_in_batches(service, unsaved, "u1", 2))
+
+    assert raised.value.saved == 0
+    assert resume_marker(unsaved, previous, raised.value) is previous
+    assert resume_marker(unsaved, previous, RuntimeError("boom")) is previous
+
+
+def test_batches_are_memorized_in_order():
+    service = StubService()
+    history = conversation(5)
+
+    asyncio.run(memorize_in_batches(service, history, "u1", 2))
+
+    assert [payload["messages"] for payload, *_ in service.memorized] == [history[0:2], history[2:4], history[4:]]